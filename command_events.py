@@ -0,0 +1,29 @@
+import json
+
+COMMAND_EVENT_DETAIL_TYPE = "EC2 Command Invocation Status-change Notification"
+TERMINAL_COMMAND_STATUSES = ["Success", "Failed", "Cancelled", "TimedOut"]
+
+
+def build_event_pattern(instance_id):
+    """Return the EventBridge pattern for terminal SSM command events on one instance."""
+    return {
+        "source": ["aws.ssm"],
+        "detail-type": [COMMAND_EVENT_DETAIL_TYPE],
+        "detail": {
+            "instance-id": [instance_id],
+            "status": TERMINAL_COMMAND_STATUSES
+        }
+    }
+
+
+def is_completion_event(body, command_id):
+    """Whether an SQS message body is the terminal status event for command_id."""
+    try:
+        event = json.loads(body)
+    except ValueError:
+        return False
+    if not isinstance(event, dict) or event.get("detail-type") != COMMAND_EVENT_DETAIL_TYPE:
+        return False
+
+    detail = event.get("detail") or {}
+    return detail.get("command-id") == command_id and detail.get("status") in TERMINAL_COMMAND_STATUSES
@@ -1,10 +1,87 @@
-import boto3
 import time
 import json
 import os
-from dotenv import load_dotenv
+import random
+import threading
+import uuid
+from dataclasses import dataclass
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENV_CACHE_PATH = os.path.expanduser("~/.cache/scientiflow/env.json")
+
+
+def _find_env_file():
+    """Return the nearest .env at or above this script's directory, like find_dotenv()."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
 
-load_dotenv()
+
+def load_env_file():
+    """Load .env into the environment, reusing the cached parse while the file is unchanged.
+    
+    On a cache hit neither the .env file nor python-dotenv is touched. Files
+    containing "$" are never cached, since dotenv expands ${VAR} from the
+    current environment; the same mtime and size means the same content, so
+    that decision is cached too.
+    """
+    path = _find_env_file()
+    if not path:
+        return
+    
+    stat = os.stat(path)
+    cache_key = f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+    
+    cached = None
+    try:
+        with open(ENV_CACHE_PATH) as f:
+            cached = json.load(f)
+        if cached.get("key") != cache_key or "cacheable" not in cached:
+            cached = None
+    except (OSError, ValueError, AttributeError):
+        cached = None
+    
+    if cached and cached.get("cacheable") and "values" in cached:
+        values = cached["values"]
+    else:
+        if cached:
+            cacheable = False  # Known to need interpolation, skip re-reading
+        else:
+            with open(path) as f:
+                cacheable = "$" not in f.read()
+        
+        from dotenv import dotenv_values
+        values = {k: v for k, v in dotenv_values(path).items() if v is not None}
+        
+        if not cached:
+            entry = {"key": cache_key, "cacheable": cacheable}
+            if cacheable:
+                entry["values"] = values
+            try:
+                # The cache holds secrets such as the Scientiflow token, so keep it private
+                os.makedirs(os.path.dirname(ENV_CACHE_PATH), mode=0o700, exist_ok=True)
+                fd = os.open(ENV_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entry, f)
+            except OSError:
+                pass
+    
+    # Like load_dotenv(), never override variables that are already set
+    for key, value in values.items():
+        os.environ.setdefault(key, value)
+
+
+load_env_file()
 
 # Configuration - Update these values
 AMI_ID = "ami-089f9ae901943684b"  # Your custom AMI ID
@@ -14,41 +91,208 @@ REGION = "us-east-1"
 SUBNET_ID = "subnet-03b096eabdbc4fe4e"  # Your subnet
 S3_BUCKET = "scientiflow-bucket"
 INSTANCE_PROFILE_NAME = "EC2-SSM-S3-Profile"
+COMMAND_LOG_GROUP = "/scientiflow/auto"  # CloudWatch log group for live command output
+# Instance pool (off by default). To enable, set POOL_SIZE > 0 and create a
+# DynamoDB table named POOL_TABLE_NAME with partition key "instance_id"
+# (String). Entries record the AMI, instance type, user and launch time of
+# their instance; instances are only reused by the same user, and ones with
+# another AMI or instance type or older than POOL_MAX_AGE_SECONDS are
+# terminated. The credentials running this script additionally need
+# ec2:StartInstances, ec2:StopInstances, ec2:TerminateInstances and
+# dynamodb:Scan, GetItem, PutItem, UpdateItem and DeleteItem on that table.
+POOL_TABLE_NAME = "scientiflow-instance-pool"  # DynamoDB table of stopped instances
+POOL_SIZE = 0  # Stopped instances kept for reuse, 0 disables the pool
+POOL_TTL_SECONDS = 6 * 3600  # Pooled instances unused for this long are terminated
+POOL_MAX_AGE_SECONDS = 24 * 3600  # Pooled instances launched this long ago are terminated
+# Wait for SSM completion events instead of polling. Each run creates its own
+# SQS queue and an EventBridge rule matching only its instance's terminal
+# "EC2 Command Invocation Status-change Notification" events, and deletes
+# both at the end. Off by default: the credentials running this script then
+# also need sqs:CreateQueue, GetQueueAttributes, ReceiveMessage,
+# DeleteMessage and DeleteQueue, and events:PutRule, PutTargets,
+# RemoveTargets and DeleteRule. Runs without it poll the command status.
+COMMAND_EVENTS_ENABLED = False
+MAX_COMMAND_SIZE = 64 * 1024  # SSM limit on the size of command parameters, in bytes
+TOKEN_PARAMETER_NAME = "/scientiflow/token"  # Prefix of the per-run SecureString read by the instance
+S5CMD_OBJECT_THRESHOLD = 1000  # Switch S3 downloads to s5cmd above this many objects
+
+# Job settings from environment: required variable -> JobConfig field
+REQUIRED_ENV_VARS = {
+    "SCIENTIFLOW_TOKEN_CONTENT": "scientiflow_token",
+    "FIRST_JOB_FLAG": "first_job_flag",
+    "EXTEND_JOB_FLAG": "extend_job_flag",
+    "INPUT_S3_PROJECT_PATH": "input_s3_project_path",
+    "USER_ID": "user_id",
+    "PROJECT_TITLE": "project_title",
+    "JOB_TITLE": "job_title",
+}
+
+
+@dataclass(frozen=True)
+class JobConfig:
+    scientiflow_token: str
+    first_job_flag: str
+    extend_job_flag: str
+    input_s3_project_path: str
+    user_id: str
+    project_title: str
+    job_title: str
+    job_id: str = ""
+
+
+def load_job_config():
+    """Read the job settings, reporting every missing variable at once."""
+    env = {name: os.environ.get(name) for name in REQUIRED_ENV_VARS}
+    missing = [name for name, value in env.items() if not value]
+    if missing:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
+    
+    return JobConfig(
+        **{REQUIRED_ENV_VARS[name]: value for name, value in env.items()},
+        job_id=os.environ.get("JOB_ID", "")
+    )
 
-# Scientiflow token from environment
-SCIENTIFLOW_TOKEN = os.getenv("SCIENTIFLOW_TOKEN_CONTENT")
-FIRST_JOB_FLAG= os.getenv("FIRST_JOB_FLAG")
-EXTEND_JOB_FLAG= os.getenv("EXTEND_JOB_FLAG")
-INPUT_S3_PROJECT_PATH = os.getenv("INPUT_S3_PROJECT_PATH")
-USER_ID = os.getenv("USER_ID")
-PROJECT_TITLE = os.getenv("PROJECT_TITLE")
-JOB_TITLE = os.getenv("JOB_TITLE")
-JOB_ID = os.getenv("JOB_ID")
-
-if not SCIENTIFLOW_TOKEN:
-    raise ValueError("SCIENTIFLOW_TOKEN_CONTENT not found in environment variables")
-if not FIRST_JOB_FLAG:
-    raise ValueError("FIRST_JOB_FLAG not found in environment variables")
-if not EXTEND_JOB_FLAG:
-    raise ValueError("EXTEND_JOB_FLAG not found in environment variables")
-if not INPUT_S3_PROJECT_PATH:
-    raise ValueError("INPUT_S3_PROJECT_PATH not found in environment variables")
-if not USER_ID:
-    raise ValueError("USER_ID not found in environment variables")
-if not PROJECT_TITLE:
-    raise ValueError("PROJECT_TITLE not found in environment variables")
-if not JOB_TITLE:
-    raise ValueError("JOB_TITLE not found in environment variables")
-
-# AWS clients
-ec2 = boto3.resource("ec2", region_name=REGION)
-ssm = boto3.client("ssm", region_name=REGION)
+
+JOB_CONFIG = load_job_config()
+
+# The AWS SDK is slow to import, so load it only once the environment is valid
+import boto3
+from botocore.config import Config
+
+from instance_pool import InstancePool
+from command_events import TERMINAL_COMMAND_STATUSES, build_event_pattern, is_completion_event
+from phase_output import SCRIPT_END_MARKER, collect_phase_results
+
+# AWS clients, sharing one session and connection settings
+AWS_CONFIG = Config(
+    max_pool_connections=32,
+    retries={"mode": "adaptive", "max_attempts": 10},
+    tcp_keepalive=True
+)
+session = boto3.Session(region_name=REGION)
+ec2 = session.client("ec2", config=AWS_CONFIG)
+ssm = session.client("ssm", config=AWS_CONFIG)
+logs = session.client("logs", config=AWS_CONFIG)
+dynamodb = session.client("dynamodb", config=AWS_CONFIG)
+sqs = session.client("sqs", config=AWS_CONFIG)
+events = session.client("events", config=AWS_CONFIG)
+
+pool = InstancePool(
+    ec2, dynamodb, POOL_TABLE_NAME, POOL_SIZE, POOL_TTL_SECONDS,
+    POOL_MAX_AGE_SECONDS, AMI_ID, INSTANCE_TYPE, JOB_CONFIG.user_id
+)
+
+
+def backoff_delay(attempt, base=0.5, rate=1.5, max_delay=5.0):
+    """Return a jittered exponential backoff delay for the given attempt."""
+    delay = min(max_delay, base * (rate ** attempt))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _cap(text, limit=1000):
+    """Limit command output stored in the results."""
+    return text[:limit] if text else ""
+
+
+# Phases of the combined SSM script: (marker name, results key)
+PHASES = [
+    ("env_check", "environment_check"),
+    ("workflow", "scientiflow_workflow"),
+    ("s3_upload", "s3_upload"),
+]
 
 
 class ScientifowAutomation:
     def __init__(self):
         self.instance_id = None
+        # Set when this run launched the instance, pooled instances keep their own
+        self.launched_at = None
         self.commands = {}
+        self.command_statuses = {}
+        # Set once the instance reached SSM and passed the environment check;
+        # only such instances go back to the pool
+        self.reusable = False
+        self.command_events_rule = None
+        self.command_events_queue_url = None
+        # Per-run name so concurrent runs never read each other's token
+        self.token_parameter_name = f"{TOKEN_PARAMETER_NAME}/{uuid.uuid4().hex}"
+    
+    def store_scientiflow_token(self):
+        """Store the Scientiflow token in Parameter Store for the instance to read."""
+        try:
+            ssm.put_parameter(
+                Name=self.token_parameter_name,
+                Type="SecureString",
+                Value=JOB_CONFIG.scientiflow_token,
+                Overwrite=True
+            )
+            print(f"✅ Scientiflow token stored in {self.token_parameter_name}")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Error storing Scientiflow token: {e}")
+            return False
+    
+    def delete_scientiflow_token(self):
+        """Remove this run's token from Parameter Store."""
+        try:
+            ssm.delete_parameter(Name=self.token_parameter_name)
+            print(f"🧹 Deleted {self.token_parameter_name}")
+        except ssm.exceptions.ParameterNotFound:
+            pass
+        except Exception as e:
+            print(f"⚠️  Error deleting {self.token_parameter_name}: {e}")
+    
+    def start_pooled_instance(self):
+        """Start a stopped instance from the pool, if one is available."""
+        if POOL_SIZE <= 0:
+            return False
+        
+        try:
+            instance_id = pool.acquire()
+        except Exception as e:
+            print(f"⚠️  Could not check the instance pool: {e}")
+            return False
+        
+        if not instance_id:
+            return False
+        
+        try:
+            print(f"♻️  Starting pooled instance {instance_id}...")
+            # The instance may still be stopping from its previous run
+            ec2.get_waiter("instance_stopped").wait(InstanceIds=[instance_id])
+            ec2.start_instances(InstanceIds=[instance_id])
+            self.instance_id = instance_id
+            return True
+            
+        except Exception as e:
+            print(f"⚠️  Could not start pooled instance {instance_id}: {e}")
+            # Discard it; if that fails too, its entry expires and is pruned later
+            try:
+                ec2.terminate_instances(InstanceIds=[instance_id])
+                pool.remove(instance_id)
+            except Exception:
+                pass
+            return False
+    
+    def prune_pool(self):
+        """Terminate pooled instances that expired or can no longer be reused."""
+        try:
+            for instance_id in pool.prune_expired():
+                print(f"🧹 Terminated stale pooled instance {instance_id}")
+        except Exception as e:
+            print(f"⚠️  Could not prune the instance pool: {e}")
+    
+    def return_to_pool(self):
+        """Stop the instance and keep it for reuse if the pool has room."""
+        try:
+            if pool.release(self.instance_id, self.launched_at):
+                print(f"⏸️  Instance {self.instance_id} stopped and returned to the pool")
+                return True
+        except Exception as e:
+            print(f"⚠️  Could not return instance to the pool: {e}")
+        
+        return False
     
     def launch_instance(self):
         """Launch EC2 instance with minimal user data."""
@@ -68,52 +312,56 @@ class ScientifowAutomation:
         """
         
         try:
-            instances = ec2.create_instances(
-                ImageId=AMI_ID,
-                InstanceType=INSTANCE_TYPE,
-                MinCount=1,
-                MaxCount=1,
-                SecurityGroupIds=[SECURITY_GROUP_ID],
-                SubnetId=SUBNET_ID,
-                IamInstanceProfile={"Name": INSTANCE_PROFILE_NAME},
-                UserData=user_data_script,
-                BlockDeviceMappings=[
-                    {
-                        'DeviceName': '/dev/sda1',  # or /dev/xvda depending on AMI
-                        'Ebs': {
-                            'VolumeSize': 20,  # GB - increase as needed
-                            'VolumeType': 'gp3',
-                            'DeleteOnTermination': True
+            if not self.start_pooled_instance():
+                self.launched_at = int(time.time())
+                response = ec2.run_instances(
+                    ImageId=AMI_ID,
+                    InstanceType=INSTANCE_TYPE,
+                    MinCount=1,
+                    MaxCount=1,
+                    SecurityGroupIds=[SECURITY_GROUP_ID],
+                    SubnetId=SUBNET_ID,
+                    IamInstanceProfile={"Name": INSTANCE_PROFILE_NAME},
+                    UserData=user_data_script,
+                    BlockDeviceMappings=[
+                        {
+                            'DeviceName': '/dev/sda1',  # or /dev/xvda depending on AMI
+                            'Ebs': {
+                                'VolumeSize': 20,  # GB - increase as needed
+                                'VolumeType': 'gp3',
+                                'DeleteOnTermination': True
+                            }
                         }
-                    }
-                ],
-                TagSpecifications=[
-                    {
-                        'ResourceType': 'instance',
-                        'Tags': [
-                            {'Key': 'Name', 'Value': f'Scientiflow-Auto-{int(time.time())}'},
-                            {'Key': 'Purpose', 'Value': 'Automation'},
-                            {'Key': 'AutoTerminate', 'Value': 'true'}
-                        ]
-                    }
-                ]
-            )
+                    ],
+                    TagSpecifications=[
+                        {
+                            'ResourceType': 'instance',
+                            'Tags': [
+                                {'Key': 'Name', 'Value': f'Scientiflow-Auto-{int(time.time())}'},
+                                {'Key': 'Purpose', 'Value': 'Automation'},
+                                {'Key': 'AutoTerminate', 'Value': 'true'}
+                            ]
+                        }
+                    ]
+                )
             
-            instance = instances[0]
-            self.instance_id = instance.id
+                self.instance_id = response["Instances"][0]["InstanceId"]
             
-            print(f"Instance {self.instance_id} launching...")
-            instance.wait_until_running()
-            instance.reload()
+                print(f"Instance {self.instance_id} launching...")
             
-            print(f"✅ Instance {self.instance_id} is running")
-            print(f"   Private IP: {instance.private_ip_address}")
-            print(f"   Public IP: {instance.public_ip_address or 'None'}")
+            ec2.get_waiter("instance_running").wait(InstanceIds=[self.instance_id])
+            
+            # Fetch the addresses in one call once the instance is running
+            instance = ec2.describe_instances(
+                InstanceIds=[self.instance_id]
+            )["Reservations"][0]["Instances"][0]
             
-            # Give instance time to complete user data and register with SSM
-            print("⏳ Waiting for instance to fully initialize...")
-            time.sleep(30)
+            print(f"✅ Instance {self.instance_id} is running")
+            print(f"   Private IP: {instance.get('PrivateIpAddress')}")
+            print(f"   Public IP: {instance.get('PublicIpAddress') or 'None'}")
             
+            # SSM registration is polled with backoff in wait_for_ssm_registration,
+            # so there is no need for a fixed initialization sleep here
             return True
             
         except Exception as e:
@@ -125,6 +373,7 @@ class ScientifowAutomation:
         print(f"⏳ Waiting for SSM registration (timeout: {timeout}s)...")
         
         start_time = time.time()
+        attempt = 0
         while time.time() - start_time < timeout:
             try:
                 response = ssm.describe_instance_information(
@@ -146,24 +395,42 @@ class ScientifowAutomation:
                     else:
                         print(f"⏳ SSM Status: {ping_status}, waiting...")
                 
+                attempt += 1
+                
             except Exception as e:
                 print(f"⚠️  Error checking SSM: {e}")
+                attempt = 0
             
-            time.sleep(10)
+            time.sleep(backoff_delay(attempt))
         
         print(f"❌ Instance not registered with SSM within {timeout} seconds")
         return False
     
     def send_command(self, commands, command_name, timeout=300):
-        """Send command via SSM and return command ID."""
+        """Send command via SSM and return command ID.
+        
+        `commands` may be a list of lines or a single script string; it is
+        sent to SSM as one pre-joined script.
+        """
         print(f"📨 Sending {command_name}...")
         
+        script = commands if isinstance(commands, str) else "\n".join(commands)
+        script_size = len(script.encode("utf-8"))
+        print(f"   Script size: {script_size} bytes")
+        if script_size > MAX_COMMAND_SIZE:
+            print(f"❌ {command_name} exceeds the SSM limit of {MAX_COMMAND_SIZE} bytes")
+            return None
+        
         try:
             response = ssm.send_command(
                 InstanceIds=[self.instance_id],
                 DocumentName="AWS-RunShellScript",
-                Parameters={"commands": commands},
-                TimeoutSeconds=timeout
+                Parameters={"commands": [script]},
+                TimeoutSeconds=timeout,
+                CloudWatchOutputConfig={
+                    "CloudWatchLogGroupName": COMMAND_LOG_GROUP,
+                    "CloudWatchOutputEnabled": True
+                }
             )
             
             command_id = response["Command"]["CommandId"]
@@ -179,41 +446,191 @@ class ScientifowAutomation:
         """Monitor command execution until completion."""
         print(f"👁️  Monitoring {command_name}...")
         
-        while True:
+        # Print output live while the command runs
+        stop_tail = threading.Event()
+        tail = threading.Thread(
+            target=self._tail_command_output,
+            args=(command_id, stop_tail),
+            daemon=True
+        )
+        tail.start()
+        
+        try:
             try:
-                result = ssm.get_command_invocation(
-                    CommandId=command_id,
-                    InstanceId=self.instance_id
+                if self.command_events_queue_url:
+                    try:
+                        self._wait_for_command_event(command_id)
+                    except Exception as e:
+                        print(f"⚠️  Error waiting for completion event, polling instead: {e}")
+                        self._poll_command(command_id)
+                else:
+                    self._poll_command(command_id)
+            finally:
+                stop_tail.set()
+                tail.join()
+            
+            result = ssm.get_command_invocation(
+                CommandId=command_id,
+                InstanceId=self.instance_id
+            )
+            
+            status = result["Status"]
+            self.command_statuses[command_id] = status
+            stdout = result.get("StandardOutputContent", "").strip()
+            stderr = result.get("StandardErrorContent", "").strip()
+            
+            if status == "Success":
+                print(f"✅ {command_name} completed successfully")
+            else:
+                print(f"❌ {command_name} failed with status: {status}")
+            
+            if stdout:
+                print(f"📋 STDOUT:\n{stdout}\n")
+            if stderr:
+                print(f"⚠️  STDERR:\n{stderr}\n")
+            
+            return status == "Success", stdout, stderr
+            
+        except Exception as e:
+            print(f"❌ Error monitoring {command_name}: {e}")
+            return False, "", str(e)
+    
+    def _command_done(self, command_id):
+        """Check once whether the command has reached a terminal status."""
+        # This replaces the command_executed waiter: limited to one attempt so
+        # the caller can back off, it made the same single API call but could
+        # only tell "still running" apart by matching botocore's error message
+        try:
+            result = ssm.get_command_invocation(
+                CommandId=command_id,
+                InstanceId=self.instance_id
+            )
+        except ssm.exceptions.InvocationDoesNotExist:
+            return False  # Not visible yet right after send_command
+        
+        return result["Status"] in TERMINAL_COMMAND_STATUSES
+    
+    def _poll_command(self, command_id):
+        """Poll until the command finishes, backing off between checks."""
+        attempt = 0
+        while not self._command_done(command_id):
+            time.sleep(backoff_delay(attempt, base=1.0, rate=1.3, max_delay=15.0))
+            attempt += 1
+    
+    def create_command_event_queue(self):
+        """Create this run's SQS queue and an EventBridge rule feeding it.
+        
+        The rule only matches terminal status changes for this run's
+        instance, and the queue is private to the run, so no other run's
+        events ever arrive on it.
+        """
+        name = f"scientiflow-{self.instance_id}-{uuid.uuid4().hex[:8]}"
+        try:
+            rule_arn = events.put_rule(
+                Name=name,
+                EventPattern=json.dumps(build_event_pattern(self.instance_id))
+            )["RuleArn"]
+            self.command_events_rule = name
+            
+            queue_url = sqs.create_queue(
+                QueueName=name,
+                Attributes={
+                    "MessageRetentionPeriod": "3600",
+                    "Policy": json.dumps({
+                        "Version": "2012-10-17",
+                        "Statement": [{
+                            "Effect": "Allow",
+                            "Principal": {"Service": "events.amazonaws.com"},
+                            "Action": "sqs:SendMessage",
+                            "Resource": "*",
+                            "Condition": {"ArnEquals": {"aws:SourceArn": rule_arn}}
+                        }]
+                    })
+                }
+            )["QueueUrl"]
+            self.command_events_queue_url = queue_url
+            
+            queue_arn = sqs.get_queue_attributes(
+                QueueUrl=queue_url,
+                AttributeNames=["QueueArn"]
+            )["Attributes"]["QueueArn"]
+            events.put_targets(Rule=name, Targets=[{"Id": "queue", "Arn": queue_arn}])
+            
+            print(f"✅ Command completion events routed to {name}")
+            return True
+            
+        except Exception as e:
+            print(f"⚠️  Could not set up command completion events, polling instead: {e}")
+            self.delete_command_event_queue()
+            return False
+    
+    def delete_command_event_queue(self):
+        """Remove this run's EventBridge rule and SQS queue."""
+        try:
+            if self.command_events_rule:
+                events.remove_targets(Rule=self.command_events_rule, Ids=["queue"])
+                events.delete_rule(Name=self.command_events_rule)
+                self.command_events_rule = None
+            if self.command_events_queue_url:
+                sqs.delete_queue(QueueUrl=self.command_events_queue_url)
+                self.command_events_queue_url = None
+        except Exception as e:
+            print(f"⚠️  Error removing command completion events: {e}")
+    
+    def _wait_for_command_event(self, command_id, fallback_interval=60):
+        """Long-poll this run's SQS queue for the command's completion event."""
+        last_check = time.time()
+        while True:
+            response = sqs.receive_message(
+                QueueUrl=self.command_events_queue_url,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=20
+            )
+            
+            for message in response.get("Messages", []):
+                # The queue belongs to this run, so every message is consumed
+                sqs.delete_message(
+                    QueueUrl=self.command_events_queue_url,
+                    ReceiptHandle=message["ReceiptHandle"]
                 )
+                if is_completion_event(message["Body"], command_id):
+                    return
+            
+            # Check directly now and then in case an event was missed, e.g.
+            # while the new rule was still propagating
+            if time.time() - last_check >= fallback_interval:
+                if self._command_done(command_id):
+                    return
+                last_check = time.time()
+    
+    def _tail_command_output(self, command_id, stop_event, interval=2):
+        """Print the command's CloudWatch log events until stop_event is set."""
+        paginator = logs.get_paginator("filter_log_events")
+        seen = set()
+        start_time = 0
+        
+        while not stop_event.wait(interval):
+            try:
+                for page in paginator.paginate(
+                    logGroupName=COMMAND_LOG_GROUP,
+                    logStreamNamePrefix=f"{command_id}/{self.instance_id}/",
+                    startTime=start_time
+                ):
+                    for event in page["events"]:
+                        if event["eventId"] in seen:
+                            continue
+                        seen.add(event["eventId"])
+                        start_time = max(start_time, event["timestamp"])
+                        print(f"📡 {event['message'].rstrip()}")
                 
-                status = result["Status"]
-                
-                if status in ["Success", "Failed", "Cancelled", "TimedOut"]:
-                    stdout = result.get("StandardOutputContent", "").strip()
-                    stderr = result.get("StandardErrorContent", "").strip()
-                    
-                    if status == "Success":
-                        print(f"✅ {command_name} completed successfully")
-                    else:
-                        print(f"❌ {command_name} failed with status: {status}")
-                    
-                    if stdout:
-                        print(f"📋 STDOUT:\n{stdout}\n")
-                    if stderr:
-                        print(f"⚠️  STDERR:\n{stderr}\n")
-                    
-                    return status == "Success", stdout, stderr
-                
-                # Command still running
-                time.sleep(5)
-                
+            except logs.exceptions.ResourceNotFoundException:
+                pass  # Log group is created when the command first writes output
             except Exception as e:
-                print(f"❌ Error monitoring {command_name}: {e}")
-                return False, "", str(e)
+                print(f"⚠️  Error tailing command output: {e}")
     
-    def run_environment_check(self):
-        """Check the environment setup."""
-        commands = [
+    def build_environment_check_script(self):
+        """Build the environment check commands."""
+        return [
             "echo '=== Environment Check ==='",
             "echo 'Current user:' $(whoami)",
             "echo 'Working directory:' $(pwd)",
@@ -230,31 +647,25 @@ class ScientifowAutomation:
             "free -h",
             "echo '=== Environment Check Complete ==='",
         ]
-        
-        command_id = self.send_command(commands, "Environment Check", 120)
-        if command_id:
-            return self.monitor_command(command_id, "Environment Check")
-        return False, "", ""
     
-    def run_scientiflow_workflow(self):
-        """Run the main Scientiflow workflow."""
-        
-        # Build the complete command as a single script
-        commands = [
-            "#!/bin/bash",
+    def build_workflow_script(self, token_parameter_name):
+        """Build the main Scientiflow workflow commands."""
+        return [
             "set -e",  # Exit on any error
             "",
             "echo '=== Scientiflow Workflow Started ==='",
             "",
             "# Set environment variables",
-            f"export SCIENTIFLOW_TOKEN=\"{SCIENTIFLOW_TOKEN}\"",
-            f"export FIRST_JOB_FLAG=\"{FIRST_JOB_FLAG}\"",
-            f"export EXTEND_JOB_FLAG=\"{EXTEND_JOB_FLAG}\"",
-            f"export INPUT_S3_PROJECT_PATH=\"{INPUT_S3_PROJECT_PATH}\"",
-            f"export USER_ID=\"{USER_ID}\"",
-            f"export PROJECT_TITLE=\"{PROJECT_TITLE}\"",
-            f"export JOB_TITLE=\"{JOB_TITLE}\"",
-            f"export JOB_ID=\"{JOB_ID}\"",
+            "# The token is read from Parameter Store so it never appears in the command",
+            f"SCIENTIFLOW_TOKEN=$(aws ssm get-parameter --name {token_parameter_name} --with-decryption --query Parameter.Value --output text --region {REGION})",
+            "export SCIENTIFLOW_TOKEN",
+            f"export FIRST_JOB_FLAG=\"{JOB_CONFIG.first_job_flag}\"",
+            f"export EXTEND_JOB_FLAG=\"{JOB_CONFIG.extend_job_flag}\"",
+            f"export INPUT_S3_PROJECT_PATH=\"{JOB_CONFIG.input_s3_project_path}\"",
+            f"export USER_ID=\"{JOB_CONFIG.user_id}\"",
+            f"export PROJECT_TITLE=\"{JOB_CONFIG.project_title}\"",
+            f"export JOB_TITLE=\"{JOB_CONFIG.job_title}\"",
+            f"export JOB_ID=\"{JOB_CONFIG.job_id}\"",
             "export PATH='/usr/local/bin:/usr/bin:/bin:/usr/local/sbin:/usr/sbin:/sbin:/root/.local/bin:/usr/local/singularity/bin:$PATH'",
             "",
             "echo \"Environment variables set:\"",
@@ -265,14 +676,16 @@ class ScientifowAutomation:
             "echo \"  JOB_TITLE: $JOB_TITLE\"",
             "echo \"  JOB_ID: $JOB_ID\"",
             "",
-            "# Create working directory",
+            "# Create a clean working directory (pooled instances keep files from earlier jobs)",
             "WORK_DIR='/root/scientiflow-work'",
+            "rm -rf $WORK_DIR",
             "mkdir -p $WORK_DIR",
             "cd $WORK_DIR",
             "echo 'Working directory:' $(pwd)",
             "",
             "# Login to Scientiflow",
             "echo '🔐 Logging into Scientiflow...'",
+            "rm -f /root/.scientiflow/key",
             "scientiflow-cli --login --token $SCIENTIFLOW_TOKEN",
             "",
             "# Verify login",
@@ -310,10 +723,31 @@ class ScientifowAutomation:
             "    echo \"📥 Downloading job directory from S3: $S3_JOB_SOURCE to $LOCAL_PROJECT_DIR\"",
             "    mkdir -p \"$LOCAL_PROJECT_DIR\"",
             "    ",
-            "    aws s3 sync \"${S3_JOB_SOURCE}\" \"${LOCAL_PROJECT_DIR}/\" --delete || {",
-            "        echo '❌ Failed to sync from S3'",
-            "        exit 1",
-            "    }",
+            "    # Transfer more objects in parallel; sync already skips unchanged files",
+            "    aws configure set default.s3.max_concurrent_requests 50",
+            "    aws configure set default.s3.multipart_chunksize 16MB",
+            "    ",
+            "    # Use s5cmd for large trees when it is installed",
+            "    SYNC_TOOL='aws'",
+            "    if command -v s5cmd > /dev/null 2>&1; then",
+            "        OBJECT_COUNT=$(aws s3 ls \"${S3_JOB_SOURCE}\" --recursive | wc -l)",
+            f"        if [ \"$OBJECT_COUNT\" -gt {S5CMD_OBJECT_THRESHOLD} ]; then",
+            "            SYNC_TOOL='s5cmd'",
+            "        fi",
+            "    fi",
+            "    ",
+            "    if [ \"$SYNC_TOOL\" = 's5cmd' ]; then",
+            "        echo \"Using s5cmd for $OBJECT_COUNT objects\"",
+            "        s5cmd sync --delete \"${S3_JOB_SOURCE}*\" \"${LOCAL_PROJECT_DIR}/\" || {",
+            "            echo '❌ Failed to sync from S3'",
+            "            exit 1",
+            "        }",
+            "    else",
+            "        aws s3 sync \"${S3_JOB_SOURCE}\" \"${LOCAL_PROJECT_DIR}/\" --delete || {",
+            "            echo '❌ Failed to sync from S3'",
+            "            exit 1",
+            "        }",
+            "    fi",
             "    ",
             "    echo '✅ Job directory downloaded from S3.'",
             "    ls -la \"$LOCAL_PROJECT_DIR\"",
@@ -354,17 +788,10 @@ class ScientifowAutomation:
             "",
             "echo '=== Scientiflow Workflow Completed Successfully ==='",
         ]
-        
-        # Send as single command with extended timeout
-        command_id = self.send_command(commands, "Complete Scientiflow Workflow", 1800)  # 30 minutes
-        if command_id:
-            return self.monitor_command(command_id, "Complete Scientiflow Workflow")
-        return False, "", ""
-    
-    def upload_results_to_s3(self):
-        """Upload results to S3."""
-        commands = [
-            "#!/bin/bash",
+    
+    def build_s3_upload_script(self):
+        """Build the S3 upload commands."""
+        return [
             "set -e",
             "",
             "echo '=== S3 Upload Started ==='",
@@ -389,27 +816,174 @@ class ScientifowAutomation:
             f"aws s3 cp testupload.py s3://{S3_BUCKET}/scientiflow_workflows/testupload_$TIMESTAMP.py ||",
             "echo '=== S3 Upload Completed ==='",
         ]
+    
+    def build_combined_script(self):
+        """Build a single script running every phase, bracketed by markers.
+        
+        Each phase runs in a subshell so its `set -e`/`exit` only ends that
+        phase. Markers go to both stdout and stderr so either stream can be
+        split per phase. A failed environment check skips the later phases,
+        and the S3 upload only runs once the workflow has succeeded.
+        """
+        phase_bodies = {
+            "env_check": self.build_environment_check_script(),
+            "workflow": self.build_workflow_script(self.token_parameter_name),
+            "s3_upload": self.build_s3_upload_script(),
+        }
         
-        command_id = self.send_command(commands, "S3 Upload", 300)
-        if command_id:
-            return self.monitor_command(command_id, "S3 Upload")
-        return False, "", ""
+        commands = [
+            "#!/bin/bash",
+            "set +e",
+            "FAILED=0",
+            "WORKFLOW_OK=0",
+        ]
+        for name, _ in PHASES:
+            commands.append("")
+            if name == "s3_upload":
+                commands.append("if [ \"$WORKFLOW_OK\" = \"1\" ]; then")
+            
+            commands += [
+                f"echo '###PHASE:{name}_begin###'",
+                f"echo '###PHASE:{name}_begin###' >&2",
+                "(",
+                *phase_bodies[name],
+                ")",
+                "RC=$?",
+                f"echo \"###PHASE:{name}_end rc=$RC###\"",
+                f"echo \"###PHASE:{name}_end rc=$RC###\" >&2",
+                "if [ $RC -ne 0 ]; then FAILED=1; fi",
+            ]
+            if name == "env_check":
+                commands.append(f"if [ $RC -ne 0 ]; then echo '{SCRIPT_END_MARKER}'; exit $RC; fi")
+            elif name == "workflow":
+                commands.append("if [ $RC -eq 0 ]; then WORKFLOW_OK=1; fi")
+            elif name == "s3_upload":
+                commands += [
+                    "else",
+                    "    echo '⏭️  Workflow failed: skipping S3 upload'",
+                    "fi",
+                ]
+        
+        commands += ["", f"echo '{SCRIPT_END_MARKER}'", "exit $FAILED"]
+        return commands
     
-    def terminate_instance(self):
-        """Terminate the EC2 instance."""
+    def _read_log_stream(self, stream_name):
+        """Return the full contents of a CloudWatch log stream."""
+        messages = []
+        kwargs = {
+            "logGroupName": COMMAND_LOG_GROUP,
+            "logStreamName": stream_name,
+            "startFromHead": True
+        }
+        while True:
+            response = logs.get_log_events(**kwargs)
+            messages.extend(event["message"].rstrip("\n") for event in response["events"])
+            # The forward token stops changing once the end of the stream is reached
+            if response["nextForwardToken"] == kwargs.get("nextToken"):
+                break
+            kwargs["nextToken"] = response["nextForwardToken"]
+        
+        return "\n".join(messages)
+    
+    def fetch_command_logs(self, command_id, timeout=60):
+        """Return the command's full (stdout, stderr) from CloudWatch Logs, or None.
+        
+        Unlike get_command_invocation, the log streams are not truncated.
+        They are uploaded shortly after the command finishes, so this waits
+        until the script's end marker shows up. Only call it for commands
+        that ran to completion, otherwise the marker never appears.
+        """
+        deadline = time.time() + timeout
+        attempt = 0
+        while True:
+            try:
+                output = {"stdout": "", "stderr": ""}
+                for page in logs.get_paginator("describe_log_streams").paginate(
+                    logGroupName=COMMAND_LOG_GROUP,
+                    logStreamNamePrefix=f"{command_id}/{self.instance_id}/"
+                ):
+                    for stream in page["logStreams"]:
+                        kind = stream["logStreamName"].rsplit("/", 1)[-1]
+                        if kind in output:
+                            output[kind] = self._read_log_stream(stream["logStreamName"])
+                
+                if SCRIPT_END_MARKER in output["stdout"]:
+                    return output["stdout"].strip(), output["stderr"].strip()
+                
+            except logs.exceptions.ResourceNotFoundException:
+                # The command has finished, so a missing group means the
+                # instance is not writing logs at all
+                print(f"⚠️  Log group {COMMAND_LOG_GROUP} not found")
+                return None
+            except Exception as e:
+                print(f"⚠️  Error reading command logs: {e}")
+                return None
+            
+            if time.time() >= deadline:
+                print("⚠️  Command logs incomplete in CloudWatch")
+                return None
+            
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+    
+    def run_combined_workflow(self):
+        """Run all phases as one SSM command and split the results per phase."""
+        command_id = self.send_command(
+            self.build_combined_script(),
+            "Scientiflow Automation",
+            120 + 1800 + 300  # env check + workflow (30 minutes) + S3 upload
+        )
+        if not command_id:
+            return {}
+        
+        success, stdout, stderr = self.monitor_command(command_id, "Scientiflow Automation")
+        
+        # The invocation output is truncated to ~24k characters shared by all
+        # phases. Only when the end marker was cut off, and the script ran to
+        # completion (so the marker exists), read the full output from CloudWatch
+        status = self.command_statuses.get(command_id)
+        if SCRIPT_END_MARKER not in stdout and status in ["Success", "Failed"]:
+            full_output = self.fetch_command_logs(command_id)
+            if full_output:
+                stdout, stderr = full_output
+            else:
+                print("⚠️  Using SSM invocation output, later phases may be truncated")
+        
+        return collect_phase_results(PHASES, stdout, stderr, success)
+    
+    def terminate_instance(self, wait=False):
+        """Terminate the EC2 instance.
+        
+        By default this returns as soon as termination is requested; pass
+        wait=True to block until the instance reaches terminated.
+        """
         if not self.instance_id:
             print("⚠️  No instance to terminate")
             return
         
+        if POOL_SIZE > 0:
+            self.prune_pool()
+            if self.reusable and self.return_to_pool():
+                return
+        
         print(f"🔥 Terminating instance {self.instance_id}...")
         
         try:
-            instance = ec2.Instance(self.instance_id)
-            instance.terminate()
+            ec2.terminate_instances(InstanceIds=[self.instance_id])
             
-            print("⏳ Waiting for termination...")
-            instance.wait_until_terminated()
-            print(f"✅ Instance {self.instance_id} terminated successfully")
+            if POOL_SIZE > 0:
+                # Drop the entry if this instance came from the pool
+                try:
+                    pool.remove(self.instance_id)
+                except Exception as e:
+                    print(f"⚠️  Could not remove {self.instance_id} from the pool: {e}")
+            
+            if wait:
+                print("⏳ Waiting for termination...")
+                ec2.get_waiter("instance_terminated").wait(InstanceIds=[self.instance_id])
+                print(f"✅ Instance {self.instance_id} terminated successfully")
+            else:
+                print(f"✅ Termination requested for {self.instance_id}, not waiting for completion")
             
         except Exception as e:
             print(f"❌ Error terminating instance: {e}")
@@ -427,6 +1001,9 @@ class ScientifowAutomation:
         try:
             print("🚀 Starting Scientiflow EC2 Automation...")
             
+            if not self.store_scientiflow_token():
+                raise Exception("Failed to store Scientiflow token")
+            
             # Launch instance
             if not self.launch_instance():
                 raise Exception("Failed to launch instance")
@@ -437,32 +1014,41 @@ class ScientifowAutomation:
             if not self.wait_for_ssm_registration():
                 raise Exception("Instance failed to register with SSM")
             
-            # Run environment check
-            env_success, env_stdout, env_stderr = self.run_environment_check()
+            if COMMAND_EVENTS_ENABLED:
+                self.create_command_event_queue()
+            
+            # Run environment check, workflow and S3 upload as a single command
+            phase_results = self.run_combined_workflow()
+            
+            env_success, env_stdout, env_stderr = phase_results.get("environment_check", (False, "", ""))
             results["commands"]["environment_check"] = {
                 "success": env_success,
-                "stdout": env_stdout[:1000] if env_stdout else "",  # Limit output size
-                "stderr": env_stderr[:1000] if env_stderr else ""
+                "stdout": _cap(env_stdout),
+                "stderr": _cap(env_stderr)
             }
             
             if not env_success:
                 raise Exception("Environment check failed")
             
-            # Run Scientiflow workflow
-            workflow_success, workflow_stdout, workflow_stderr = self.run_scientiflow_workflow()
+            self.reusable = True
+            
+            workflow_success, workflow_stdout, workflow_stderr = phase_results.get("scientiflow_workflow", (False, "", ""))
             results["commands"]["scientiflow_workflow"] = {
                 "success": workflow_success,
-                "stdout": workflow_stdout[:1000] if workflow_stdout else "",
-                "stderr": workflow_stderr[:1000] if workflow_stderr else ""
+                "stdout": _cap(workflow_stdout),
+                "stderr": _cap(workflow_stderr)
             }
             
-            # Upload to S3 (continue even if workflow failed)
-            s3_success, s3_stdout, s3_stderr = self.upload_results_to_s3()
-            results["commands"]["s3_upload"] = {
-                "success": s3_success,
-                "stdout": s3_stdout[:1000] if s3_stdout else "",
-                "stderr": s3_stderr[:1000] if s3_stderr else ""
-            }
+            # S3 upload only runs when the workflow succeeded
+            if "s3_upload" not in phase_results and not workflow_success:
+                results["commands"]["s3_upload"] = {"skipped": True}
+            else:
+                s3_success, s3_stdout, s3_stderr = phase_results.get("s3_upload", (False, "", ""))
+                results["commands"]["s3_upload"] = {
+                    "success": s3_success,
+                    "stdout": _cap(s3_stdout),
+                    "stderr": _cap(s3_stderr)
+                }
             
             # Mark as successful if workflow succeeded
             results["success"] = workflow_success
@@ -474,14 +1060,26 @@ class ScientifowAutomation:
             results["error"] = str(e)
             
         finally:
-            # Always terminate instance
+            # Always terminate instance and remove the stored token
             self.terminate_instance()
+            self.delete_scientiflow_token()
+            self.delete_command_event_queue()
             results["end_time"] = time.time()
             results["duration"] = results["end_time"] - results["start_time"]
             
         return results
 
 
+def save_results(results, path):
+    """Write results as JSON, using orjson when it is installed."""
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(results, default=str, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w") as f:
+            json.dump(results, f, separators=(",", ":"), default=str)
+
+
 def main():
     """Main function to run the automation."""
     automation = ScientifowAutomation()
@@ -503,13 +1101,15 @@ def main():
         print(f"Error: {results['error']}")
     
     for cmd_name, cmd_result in results.get('commands', {}).items():
-        print(f"{cmd_name}: {'✅ SUCCESS' if cmd_result['success'] else '❌ FAILED'}")
+        if cmd_result.get('skipped'):
+            print(f"{cmd_name}: ⏭️  SKIPPED")
+        else:
+            print(f"{cmd_name}: {'✅ SUCCESS' if cmd_result['success'] else '❌ FAILED'}")
     
     print("="*60)
     
     # Save detailed results to file
-    with open(f"automation_results_{int(time.time())}.json", "w") as f:
-        json.dump(results, f, indent=2, default=str)
+    save_results(results, f"automation_results_{int(time.time())}.json")
     
     return results['success']
 
@@ -0,0 +1,183 @@
+import time
+
+from botocore.exceptions import ClientError
+
+
+class InstancePool:
+    """Track stopped EC2 instances kept for reuse in a DynamoDB table.
+
+    The table is keyed on "instance_id" (string) and stores "state"
+    ("free", "in_use" or "pruning"), "expires_at" and "launched_at" (epoch
+    seconds), and the "ami_id", "instance_type" and "user_id" the instance
+    was pooled with. Instances are only handed to runs of the same user, and
+    ones from another AMI or instance type, or older than max_age_seconds
+    since launch, are terminated instead of reused.
+
+    Claiming an instance refreshes its expiry, so entries left "in_use" by a
+    crashed run expire like unused ones. Every state change is a conditional
+    write on the state and expiry last read, so concurrent runs never act on
+    the same entry.
+    """
+
+    def __init__(self, ec2, dynamodb, table_name, max_size, ttl_seconds,
+                 max_age_seconds, ami_id, instance_type, user_id):
+        self.ec2 = ec2
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_age_seconds = max_age_seconds
+        self.ami_id = ami_id
+        self.instance_type = instance_type
+        self.user_id = user_id
+
+    def _items(self, state=None):
+        """Return all pool entries, optionally only those in the given state."""
+        kwargs = {"TableName": self.table_name, "ConsistentRead": True}
+        if state:
+            kwargs["FilterExpression"] = "#s = :state"
+            kwargs["ExpressionAttributeNames"] = {"#s": "state"}
+            kwargs["ExpressionAttributeValues"] = {":state": {"S": state}}
+
+        items = []
+        for page in self.dynamodb.get_paginator("scan").paginate(**kwargs):
+            items.extend(page["Items"])
+        return items
+
+    def _is_stale(self, item, now):
+        """Whether an entry is from another AMI/instance type or past its maximum age."""
+        if item.get("ami_id", {}).get("S") != self.ami_id:
+            return True
+        if item.get("instance_type", {}).get("S") != self.instance_type:
+            return True
+        launched_at = int(item.get("launched_at", {}).get("N", 0))
+        return now - launched_at >= self.max_age_seconds
+
+    def _transition(self, item, new_state, expires_at):
+        """Move an entry to a new state unless it changed since it was read."""
+        try:
+            self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key={"instance_id": item["instance_id"]},
+                UpdateExpression="SET #s = :new_state, expires_at = :new_expires",
+                ConditionExpression="#s = :old_state AND expires_at = :old_expires",
+                ExpressionAttributeNames={"#s": "state"},
+                ExpressionAttributeValues={
+                    ":new_state": {"S": new_state},
+                    ":new_expires": {"N": str(expires_at)},
+                    ":old_state": item["state"],
+                    ":old_expires": item["expires_at"],
+                }
+            )
+            return True
+
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    def _retire(self, item):
+        """Terminate an entry's instance, then drop the entry.
+
+        The entry is marked "pruning" first so no run can claim it, and only
+        removed once termination succeeded, so a failure is retried later.
+        Returns False if the entry changed in the meantime.
+        """
+        if item["state"]["S"] != "pruning":
+            if not self._transition(item, "pruning", item["expires_at"]["N"]):
+                return False
+
+        instance_id = item["instance_id"]["S"]
+        try:
+            self.ec2.terminate_instances(InstanceIds=[instance_id])
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "InvalidInstanceID.NotFound":
+                raise
+
+        self.remove(instance_id)
+        return True
+
+    def acquire(self):
+        """Claim a free pooled instance and return its ID, or None if the pool is empty."""
+        now = int(time.time())
+        for item in self._items(state="free"):
+            if int(item["expires_at"]["N"]) < now:
+                continue  # Left for prune_expired
+
+            if self._is_stale(item, now):
+                self._retire(item)
+                continue
+
+            if item.get("user_id", {}).get("S") != self.user_id:
+                continue  # Pooled for another user
+
+            if self._transition(item, "in_use", now + self.ttl_seconds):
+                return item["instance_id"]["S"]
+            # Claimed by another run, try the next one
+
+        return None
+
+    def release(self, instance_id, launched_at=None):
+        """Stop the instance and return it to the pool.
+
+        `launched_at` is when a newly launched instance started; instances
+        that came from the pool keep their recorded launch time. Returns
+        False without stopping the instance if it is past its maximum age or
+        the pool is already full, in which case the caller should terminate
+        it. Expired entries do not count towards the pool size.
+        """
+        now = int(time.time())
+        items = self._items()
+        existing = next((item for item in items if item["instance_id"]["S"] == instance_id), None)
+        if existing and "launched_at" in existing:
+            launched_at = int(existing["launched_at"]["N"])
+        launched_at = int(launched_at or now)
+        if now - launched_at >= self.max_age_seconds:
+            return False
+
+        pooled_ids = {
+            item["instance_id"]["S"]
+            for item in items
+            if int(item["expires_at"]["N"]) >= now
+        }
+        if instance_id not in pooled_ids and len(pooled_ids) >= self.max_size:
+            return False
+
+        self.ec2.stop_instances(InstanceIds=[instance_id])
+        self.dynamodb.put_item(
+            TableName=self.table_name,
+            Item={
+                "instance_id": {"S": instance_id},
+                "state": {"S": "free"},
+                "expires_at": {"N": str(now + self.ttl_seconds)},
+                "launched_at": {"N": str(launched_at)},
+                "ami_id": {"S": self.ami_id},
+                "instance_type": {"S": self.instance_type},
+                "user_id": {"S": self.user_id},
+            }
+        )
+        return True
+
+    def remove(self, instance_id):
+        """Drop an instance from the pool without touching the instance."""
+        self.dynamodb.delete_item(
+            TableName=self.table_name,
+            Key={"instance_id": {"S": instance_id}}
+        )
+
+    def prune_expired(self):
+        """Terminate expired or stale instances and return their IDs.
+
+        This covers unused free instances, ones left in use by a crashed run,
+        and free ones from another AMI or instance type or past their
+        maximum age.
+        """
+        now = int(time.time())
+        pruned = []
+        for item in self._items():
+            expired = int(item["expires_at"]["N"]) < now
+            stale = item["state"]["S"] == "free" and self._is_stale(item, now)
+            if (expired or stale) and self._retire(item):
+                pruned.append(item["instance_id"]["S"])
+
+        return pruned
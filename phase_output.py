@@ -0,0 +1,54 @@
+import re
+
+SCRIPT_END_MARKER = "###SCRIPT_END###"  # Last line of the combined script's stdout
+
+PHASE_BEGIN_RE = re.compile(r"###PHASE:(\w+)_begin###")
+PHASE_END_RE = re.compile(r"###PHASE:(\w+)_end rc=(\d+)###")
+
+
+def split_phase_output(output):
+    """Split combined script output into {phase: (output, exit code or None)}."""
+    phases = {}
+    current = None
+    for line in output.splitlines():
+        begin = PHASE_BEGIN_RE.fullmatch(line.strip())
+        end = PHASE_END_RE.fullmatch(line.strip())
+        if begin:
+            current = begin.group(1)
+            phases[current] = {"lines": [], "rc": None}
+        elif end and end.group(1) in phases:
+            phases[end.group(1)]["rc"] = int(end.group(2))
+            current = None
+        elif current:
+            phases[current]["lines"].append(line)
+
+    return {
+        name: ("\n".join(phase["lines"]).strip(), phase["rc"])
+        for name, phase in phases.items()
+    }
+
+
+def collect_phase_results(phases, stdout, stderr, command_success):
+    """Return {results key: (success, stdout, stderr)} for every phase that started.
+
+    `phases` is a list of (marker name, results key). A phase's exit code
+    comes from its stdout end marker, or from stderr when stdout lost it.
+    Without either marker (e.g. truncated output) the phase takes the
+    overall command status.
+    """
+    stdout_phases = split_phase_output(stdout)
+    stderr_phases = split_phase_output(stderr)
+
+    results = {}
+    for name, key in phases:
+        if name not in stdout_phases and name not in stderr_phases:
+            continue  # Phase never started
+
+        phase_stdout, rc = stdout_phases.get(name, ("", None))
+        phase_stderr, stderr_rc = stderr_phases.get(name, ("", None))
+        if rc is None:
+            rc = stderr_rc
+
+        results[key] = (command_success if rc is None else rc == 0, phase_stdout, phase_stderr)
+
+    return results
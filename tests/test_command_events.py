@@ -0,0 +1,48 @@
+import json
+import unittest
+
+from command_events import build_event_pattern, is_completion_event
+
+
+def event_body(command_id="cmd-1", status="Success",
+               detail_type="EC2 Command Invocation Status-change Notification"):
+    return json.dumps({
+        "source": "aws.ssm",
+        "detail-type": detail_type,
+        "detail": {"command-id": command_id, "instance-id": "i-1", "status": status},
+    })
+
+
+class BuildEventPatternTest(unittest.TestCase):
+    def test_matches_terminal_command_invocation_events_for_instance(self):
+        self.assertEqual(build_event_pattern("i-1"), {
+            "source": ["aws.ssm"],
+            "detail-type": ["EC2 Command Invocation Status-change Notification"],
+            "detail": {
+                "instance-id": ["i-1"],
+                "status": ["Success", "Failed", "Cancelled", "TimedOut"],
+            },
+        })
+
+
+class IsCompletionEventTest(unittest.TestCase):
+    def test_accepts_terminal_event_for_command(self):
+        for status in ["Success", "Failed", "Cancelled", "TimedOut"]:
+            self.assertTrue(is_completion_event(event_body(status=status), "cmd-1"))
+
+    def test_rejects_other_commands_and_non_terminal_statuses(self):
+        self.assertFalse(is_completion_event(event_body(command_id="cmd-2"), "cmd-1"))
+        self.assertFalse(is_completion_event(event_body(status="InProgress"), "cmd-1"))
+
+    def test_rejects_other_event_types(self):
+        body = event_body(detail_type="EC2 Command Status-change Notification")
+        self.assertFalse(is_completion_event(body, "cmd-1"))
+
+    def test_rejects_malformed_bodies(self):
+        self.assertFalse(is_completion_event("not json", "cmd-1"))
+        self.assertFalse(is_completion_event("[]", "cmd-1"))
+        self.assertFalse(is_completion_event(json.dumps({"detail-type": "x"}), "cmd-1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
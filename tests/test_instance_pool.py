@@ -0,0 +1,207 @@
+import time
+import unittest
+
+from botocore.exceptions import ClientError
+
+from instance_pool import InstancePool
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "operation")
+
+
+class FakeDynamoDB:
+    """In-memory table supporting the calls InstancePool makes."""
+
+    def __init__(self):
+        self.items = {}
+        self.lose_race_for = set()
+
+    def add(self, instance_id, state, expires_at, launched_at=None,
+            ami_id="ami-1", instance_type="t3.micro", user_id="user-1"):
+        self.items[instance_id] = {
+            "instance_id": {"S": instance_id},
+            "state": {"S": state},
+            "expires_at": {"N": str(expires_at)},
+            "launched_at": {"N": str(launched_at or int(time.time()))},
+            "ami_id": {"S": ami_id},
+            "instance_type": {"S": instance_type},
+            "user_id": {"S": user_id},
+        }
+
+    def state(self, instance_id):
+        return self.items[instance_id]["state"]["S"]
+
+    def get_paginator(self, name):
+        assert name == "scan"
+        return self
+
+    def paginate(self, **kwargs):
+        items = list(self.items.values())
+        if "FilterExpression" in kwargs:
+            state = kwargs["ExpressionAttributeValues"][":state"]
+            items = [item for item in items if item["state"] == state]
+        return [{"Items": [dict(item) for item in items]}]
+
+    def update_item(self, Key, ExpressionAttributeValues, **kwargs):
+        instance_id = Key["instance_id"]["S"]
+        values = ExpressionAttributeValues
+        item = self.items.get(instance_id)
+        if (
+            instance_id in self.lose_race_for
+            or item is None
+            or item["state"] != values[":old_state"]
+            or item["expires_at"] != values[":old_expires"]
+        ):
+            raise client_error("ConditionalCheckFailedException")
+        item["state"] = values[":new_state"]
+        item["expires_at"] = values[":new_expires"]
+
+    def put_item(self, Item, **kwargs):
+        self.items[Item["instance_id"]["S"]] = Item
+
+    def delete_item(self, Key, **kwargs):
+        self.items.pop(Key["instance_id"]["S"], None)
+
+
+class FakeEC2:
+    def __init__(self):
+        self.stopped = []
+        self.terminated = []
+        self.fail_terminate = False
+
+    def stop_instances(self, InstanceIds):
+        self.stopped.extend(InstanceIds)
+
+    def terminate_instances(self, InstanceIds):
+        if self.fail_terminate:
+            raise client_error("InternalError")
+        self.terminated.extend(InstanceIds)
+
+
+class InstancePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.now = int(time.time())
+        self.ec2 = FakeEC2()
+        self.dynamodb = FakeDynamoDB()
+        self.pool = InstancePool(
+            self.ec2, self.dynamodb, "pool", max_size=2, ttl_seconds=3600,
+            max_age_seconds=86400, ami_id="ami-1", instance_type="t3.micro", user_id="user-1"
+        )
+
+    def test_acquire_claims_free_instance_and_refreshes_expiry(self):
+        self.dynamodb.add("i-1", "free", self.now + 10)
+
+        self.assertEqual(self.pool.acquire(), "i-1")
+        self.assertEqual(self.dynamodb.state("i-1"), "in_use")
+        expires_at = int(self.dynamodb.items["i-1"]["expires_at"]["N"])
+        self.assertGreaterEqual(expires_at, self.now + 3600)
+        self.assertIsNone(self.pool.acquire())
+
+    def test_acquire_skips_expired_and_lost_races(self):
+        self.dynamodb.add("i-expired", "free", self.now - 10)
+        self.dynamodb.add("i-raced", "free", self.now + 10)
+        self.dynamodb.add("i-ok", "free", self.now + 10)
+        self.dynamodb.lose_race_for.add("i-raced")
+
+        self.assertEqual(self.pool.acquire(), "i-ok")
+        self.assertEqual(self.dynamodb.state("i-expired"), "free")
+
+    def test_acquire_terminates_other_ami_or_instance_type(self):
+        self.dynamodb.add("i-old-ami", "free", self.now + 10, ami_id="ami-0")
+        self.dynamodb.add("i-old-type", "free", self.now + 10, instance_type="t3.large")
+
+        self.assertIsNone(self.pool.acquire())
+        self.assertCountEqual(self.ec2.terminated, ["i-old-ami", "i-old-type"])
+        self.assertEqual(self.dynamodb.items, {})
+
+    def test_acquire_terminates_instances_past_max_age(self):
+        self.dynamodb.add("i-old", "free", self.now + 10, launched_at=self.now - 86400)
+        self.dynamodb.add("i-new", "free", self.now + 10, launched_at=self.now - 3600)
+
+        self.assertEqual(self.pool.acquire(), "i-new")
+        self.assertEqual(self.ec2.terminated, ["i-old"])
+
+    def test_acquire_skips_other_users_instances(self):
+        self.dynamodb.add("i-other", "free", self.now + 10, user_id="user-2")
+
+        self.assertIsNone(self.pool.acquire())
+        self.assertEqual(self.dynamodb.state("i-other"), "free")
+        self.assertEqual(self.ec2.terminated, [])
+
+    def test_release_stops_instance_and_marks_it_free(self):
+        self.assertTrue(self.pool.release("i-1"))
+        self.assertEqual(self.ec2.stopped, ["i-1"])
+        self.assertEqual(self.dynamodb.state("i-1"), "free")
+        item = self.dynamodb.items["i-1"]
+        self.assertEqual(item["ami_id"], {"S": "ami-1"})
+        self.assertEqual(item["instance_type"], {"S": "t3.micro"})
+        self.assertEqual(item["user_id"], {"S": "user-1"})
+
+    def test_release_keeps_original_launch_time(self):
+        self.dynamodb.add("i-1", "in_use", self.now + 10, launched_at=self.now - 3600)
+
+        self.assertTrue(self.pool.release("i-1"))
+        self.assertEqual(self.dynamodb.items["i-1"]["launched_at"], {"N": str(self.now - 3600)})
+
+    def test_release_refuses_instances_past_max_age(self):
+        self.dynamodb.add("i-1", "in_use", self.now + 10, launched_at=self.now - 86400)
+
+        self.assertFalse(self.pool.release("i-1"))
+        self.assertFalse(self.pool.release("i-2", launched_at=self.now - 86400))
+        self.assertEqual(self.ec2.stopped, [])
+
+    def test_release_refuses_when_pool_is_full(self):
+        self.dynamodb.add("i-1", "free", self.now + 10)
+        self.dynamodb.add("i-2", "in_use", self.now + 10)
+
+        self.assertFalse(self.pool.release("i-3"))
+        self.assertEqual(self.ec2.stopped, [])
+        # An instance that is already pooled can always be returned
+        self.assertTrue(self.pool.release("i-2"))
+
+    def test_release_ignores_expired_entries_in_pool_size(self):
+        self.dynamodb.add("i-1", "in_use", self.now - 10)
+        self.dynamodb.add("i-2", "in_use", self.now - 10)
+
+        self.assertTrue(self.pool.release("i-3"))
+
+    def test_prune_terminates_expired_free_and_stale_in_use(self):
+        self.dynamodb.add("i-free", "free", self.now - 10)
+        self.dynamodb.add("i-stale", "in_use", self.now - 10)
+        self.dynamodb.add("i-fresh", "free", self.now + 10)
+
+        self.assertCountEqual(self.pool.prune_expired(), ["i-free", "i-stale"])
+        self.assertCountEqual(self.ec2.terminated, ["i-free", "i-stale"])
+        self.assertEqual(list(self.dynamodb.items), ["i-fresh"])
+
+    def test_prune_terminates_free_instances_past_max_age(self):
+        self.dynamodb.add("i-old", "free", self.now + 10, launched_at=self.now - 86400)
+        self.dynamodb.add("i-busy", "in_use", self.now + 10, launched_at=self.now - 86400)
+
+        self.assertEqual(self.pool.prune_expired(), ["i-old"])
+        self.assertEqual(list(self.dynamodb.items), ["i-busy"])
+
+    def test_prune_keeps_entry_when_terminate_fails(self):
+        self.dynamodb.add("i-1", "free", self.now - 10)
+        self.ec2.fail_terminate = True
+
+        with self.assertRaises(ClientError):
+            self.pool.prune_expired()
+        self.assertEqual(self.dynamodb.state("i-1"), "pruning")
+        self.assertIsNone(self.pool.acquire())
+
+        self.ec2.fail_terminate = False
+        self.assertEqual(self.pool.prune_expired(), ["i-1"])
+        self.assertEqual(self.dynamodb.items, {})
+
+    def test_prune_skips_entry_claimed_in_the_meantime(self):
+        self.dynamodb.add("i-1", "free", self.now - 10)
+        self.dynamodb.lose_race_for.add("i-1")
+
+        self.assertEqual(self.pool.prune_expired(), [])
+        self.assertEqual(self.ec2.terminated, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
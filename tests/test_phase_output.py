@@ -0,0 +1,70 @@
+import unittest
+
+from phase_output import SCRIPT_END_MARKER, collect_phase_results, split_phase_output
+
+PHASES = [("env_check", "environment_check"), ("workflow", "scientiflow_workflow")]
+
+
+class SplitPhaseOutputTest(unittest.TestCase):
+    def test_splits_output_between_markers(self):
+        output = "\n".join([
+            "###PHASE:env_check_begin###",
+            "checking",
+            "###PHASE:env_check_end rc=0###",
+            "###PHASE:workflow_begin###",
+            "running",
+            "more",
+            "###PHASE:workflow_end rc=3###",
+            SCRIPT_END_MARKER,
+        ])
+
+        self.assertEqual(split_phase_output(output), {
+            "env_check": ("checking", 0),
+            "workflow": ("running\nmore", 3),
+        })
+
+    def test_missing_end_marker_leaves_exit_code_unknown(self):
+        output = "###PHASE:workflow_begin###\nrunning\ntrunc"
+
+        self.assertEqual(split_phase_output(output), {"workflow": ("running\ntrunc", None)})
+
+    def test_ignores_lines_outside_phases_and_stray_end_markers(self):
+        output = "noise\n###PHASE:workflow_end rc=0###\n" + SCRIPT_END_MARKER
+
+        self.assertEqual(split_phase_output(output), {})
+
+
+class CollectPhaseResultsTest(unittest.TestCase):
+    def test_uses_stdout_exit_codes_and_skips_unstarted_phases(self):
+        stdout = "###PHASE:env_check_begin###\nok\n###PHASE:env_check_end rc=1###"
+        stderr = "###PHASE:env_check_begin###\nboom\n###PHASE:env_check_end rc=1###"
+
+        self.assertEqual(collect_phase_results(PHASES, stdout, stderr, True), {
+            "environment_check": (False, "ok", "boom"),
+        })
+
+    def test_falls_back_to_stderr_exit_code(self):
+        stdout = "###PHASE:workflow_begin###\nlong output cut off"
+        stderr = "###PHASE:workflow_begin###\n###PHASE:workflow_end rc=0###"
+
+        self.assertEqual(collect_phase_results(PHASES, stdout, stderr, False), {
+            "scientiflow_workflow": (True, "long output cut off", ""),
+        })
+
+    def test_phase_only_in_stderr_is_reported(self):
+        stderr = "###PHASE:workflow_begin###\nerr\n###PHASE:workflow_end rc=2###"
+
+        self.assertEqual(collect_phase_results(PHASES, "", stderr, True), {
+            "scientiflow_workflow": (False, "", "err"),
+        })
+
+    def test_without_markers_uses_command_status(self):
+        stdout = "###PHASE:workflow_begin###\ncut"
+
+        self.assertEqual(collect_phase_results(PHASES, stdout, "", True), {
+            "scientiflow_workflow": (True, "cut", ""),
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()